@@ -0,0 +1,164 @@
+# cython: language_level=3
+"""
+compiled versions of the functions in core used to parse isotropy's tables,
+core falls back to its pure python versions if this isn't built
+"""
+
+cdef inline bint _is_space(Py_UCS4 c):
+    return c == u' '
+
+def detect_column_indexes(list list_of_lines):
+    cdef Py_ssize_t nlines = len(list_of_lines)
+    cdef Py_ssize_t ncols, col, row
+    cdef str line, header
+    cdef bint prev_all_space, this_all_space
+    cdef list indexes = [0]
+    if nlines == 0:
+        return indexes
+    # only columns present in every line are considered (as zip(*lines) would)
+    ncols = min(len(line) for line in list_of_lines)
+    if ncols == 0:
+        return indexes
+    header = list_of_lines[0]
+    prev_all_space = False
+    for col in range(ncols):
+        this_all_space = True
+        for row in range(nlines):
+            line = list_of_lines[row]
+            if not _is_space(line[col]):
+                this_all_space = False
+                break
+        # a new column starts where an all space column is followed by one that isn't
+        # and the header has a character there
+        if col > 0 and prev_all_space and not this_all_space and not _is_space(header[col]):
+            indexes.append(col)
+        prev_all_space = this_all_space
+    return indexes
+
+def split_line_by_indexes(list indexes, str line):
+    cdef Py_ssize_t n = len(indexes)
+    cdef Py_ssize_t i
+    cdef list tokens = [None] * n
+    for i in range(n - 1):
+        tokens[i] = line[indexes[i]:indexes[i + 1]].rstrip()
+    tokens[n - 1] = line[indexes[n - 1]:].rstrip()
+    return tokens
+
+def detect_multirows_and_split(list split_lines):
+    cdef list headers
+    cdef list result_list = []
+    cdef list row
+    cdef Py_ssize_t i, n
+    result = None
+    # isotropy printed nothing
+    if not split_lines:
+        return result_list
+    headers = split_lines[0]
+    # every property is collected in a list, properties only found
+    # on one row are taken out of their list at the end
+    for row in split_lines[1:]:
+        n = min(len(headers), len(row))
+        if row[0]:
+            result = {}
+            result_list.append(result)
+            for i in range(n):
+                result[headers[i]] = [row[i]]
+        else:
+            for i in range(n):
+                if row[i]:
+                    result[headers[i]].append(row[i])
+    return [{key: props[0] if len(props) == 1 else props
+             for key, props in result.items()}
+            for result in result_list]
+
+cdef list _split_outside_paren(str prop, Py_UCS4 sep):
+    # split prop at sep (and any whitespace following it), skipping any sep
+    # inside paren, i.e. where the next paren after sep is a closing one
+    cdef Py_ssize_t n = len(prop)
+    cdef Py_ssize_t i, j, start = 0
+    cdef Py_UCS4 c
+    cdef bint inside
+    cdef list pieces = []
+    for i in range(n):
+        if prop[i] != sep:
+            continue
+        inside = False
+        for j in range(i + 1, n):
+            c = prop[j]
+            if c == u')':
+                inside = True
+                break
+            if c == u'(':
+                break
+        if inside:
+            continue
+        pieces.append(prop[start:i])
+        start = i + 1
+        while start < n and prop[start].isspace():
+            start += 1
+    pieces.append(prop[start:])
+    return pieces
+
+cdef list _paren_contents(str prop):
+    # contents of each (non-empty) paren in prop, like re.findall(r'\((.+?)\)', prop)
+    cdef list contents = []
+    cdef Py_ssize_t pos = 0
+    cdef Py_ssize_t opening, closing
+    while True:
+        opening = prop.find(u'(', pos)
+        if opening == -1:
+            break
+        closing = prop.find(u')', opening + 2)
+        if closing == -1:
+            break
+        contents.append(prop[opening + 1:closing])
+        pos = closing + 1
+    return contents
+
+cdef object _split_prop(str prop):
+    cdef list pieces
+    # first split by '|'s (but not '|'s inside paren)
+    if u'|' in prop:
+        pieces = _split_outside_paren(prop, u'|')
+        if len(pieces) > 1:
+            return pieces
+    # first split by commas (but not commas inside paren)
+    if u',' in prop:
+        pieces = _split_outside_paren(prop, u',')
+        if len(pieces) > 1:
+            return pieces
+    # remove paren if entirely surrounded in paren with no inner paren
+    # return list of paren surrouned bits if there are multiple
+    if prop.endswith(u')') and prop.lstrip().startswith(u'('):
+        pieces = _paren_contents(prop)
+        if len(pieces) > 1:
+            return pieces
+        return pieces[0]
+    # next split by spaces
+    pieces = prop.split()
+    if len(pieces) > 1:
+        return pieces
+    return None
+
+def detect_data_form_and_convert(prop):
+    cdef list result, container, pieces, stack
+    cdef Py_ssize_t index, i
+    cdef str this_prop
+    # if it is a list operate on each element
+    if isinstance(prop, list):
+        return [detect_data_form_and_convert(p) for p in prop]
+    result = [None]
+    stack = [(prop, result, 0)]
+    while stack:
+        this_prop, container, index = stack.pop()
+        split = _split_prop(this_prop)
+        if split is None:
+            container[index] = this_prop.strip()
+        elif isinstance(split, str):
+            # unwrapped from paren, needs to be split again
+            stack.append((split, container, index))
+        else:
+            container[index] = pieces = [None] * len(<list>split)
+            for i in range(len(pieces)):
+                stack.append(((<list>split)[i], pieces, i))
+    return result[0]
@@ -3,15 +3,19 @@
 Python interface to isotropy
 """
 import os
+import sys
 import logging
 import time
-from itertools import permutations, combinations
+import threading
+from copy import deepcopy
+from functools import lru_cache
+from itertools import chain, combinations
+from collections import namedtuple
 try:
     from collections.abc import MutableMapping, MutableSet
 except ImportError:
     from collections import MutableMapping, MutableSet
 from subprocess import PIPE
-import re
 from glob import glob
 from fractions import Fraction
 import numpy as np
@@ -20,6 +24,18 @@ from sarge import Command, Capture
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
+# messages looked for in every line read from isotropy
+_MSG_BOMB = 'program has bombed'
+_MSG_BASIS = 'Basis vectors are not a right-handed set'
+_MSG_SUBGRP = 'not all elements of the subgroup are elements of parent group'
+_MSG_REQUESTED = 'You have requested information about '
+_MSG_COUPLED_DB = 'Data base for these coupled subgroups '
+
+# strings of all fractions with denominator <= 10, keyed by their value rounded to 6 decimals
+_FRAC10_TABLE = {round(p / q, 6): str(Fraction(p, q)) for q in range(1, 11) for p in range(-10 * q, 10 * q + 1)}
+# the ones that are exactly representable as floats, keyed by that float
+_EXACT_FRAC_TABLE = {p / q: str(Fraction(p, q)) for q in (1, 2, 4, 8) for p in range(-10 * q, 10 * q + 1)}
+
 class IsotropyBombedException(Exception):
     """Raised when Isotropy Bombs"""
     pass
@@ -34,22 +50,32 @@ class IsotropySubgroupException(Exception):
     pass
 
 
+# upper case (interned) form of every show/value name seen so far
+_UPPER_KEYS = {}
+
+def _upper_key(key):
+    """upper case form of key, each distinct key is only upper()ed once"""
+    try:
+        return _UPPER_KEYS[key]
+    except KeyError:
+        upper = _UPPER_KEYS[key] = sys.intern(key.upper())
+        return upper
+
+
 class Shows(MutableSet):
     def __init__(self, parent, initial_shows):
         self._shows = set()
         self.parent = parent
         if initial_shows:
             for item in initial_shows:
-                item = item.upper()
-                self.add(item)
+                self._add(_upper_key(item))
 
     def update(self, iterable):
         for i in iterable:
-            self.add(i)
+            self._add(_upper_key(i))
 
     def __contains__(self, item):
-        item = item.upper()
-        return item in self._shows
+        return _upper_key(item) in self._shows
 
     def __iter__(self):
         return iter(self._shows)
@@ -58,29 +84,32 @@ class Shows(MutableSet):
         return len(self._shows)
 
     def add(self, item):
-        item = item.upper()
+        self._add(_upper_key(item))
+
+    def _add(self, item):
+        """add an item which is already upper case"""
         if item not in self._shows:
-            self.parent.sendCommand("SHOW {}".format(item))
+            self.parent.queueCommand(f"SHOW {item}")
             self._shows.add(item)
 
     def discard(self, item):
-        item = item.upper()
+        item = _upper_key(item)
         try:
             self._shows.remove(item)
-            self.parent.sendCommand("CANCEL SHOW {}".format(item))
+            self.parent.queueCommand(f"CANCEL SHOW {item}")
         except ValueError:
             pass
 
     def clearAll(self):
-        self.parent.sendCommand("CANCEL SHOW ALL")
+        self.parent.queueCommand("CANCEL SHOW ALL")
         self._shows = set()
 
 
 class Values(MutableMapping):
     """
     Acts like a dictionary for values set in isotropy,
-    when values are set and deleted the appropriate calls
-    to the IsotropySession are made
+    when values are set and deleted the appropriate commands
+    are queued in the IsotropySession (sent before the next command)
     """
     def __init__(self, parent, initial_values):
         '''Use the object dict'''
@@ -88,22 +117,25 @@ class Values(MutableMapping):
         self._vals = dict()
         if initial_values:
             for k, v in initial_values.items():
-                k = k.upper()
-                self.__setitem__(k, v)
+                self._set(_upper_key(k), v)
 
     def __setitem__(self, key, value):
-        key = key.upper()
+        self._set(_upper_key(key), value)
+
+    def _set(self, key, value):
+        """set a value whose key is already upper case"""
+        # values are stored as the string sent to isotropy so comparing is cheap
+        value = _canon_value(value)
         if key not in self._vals or self._vals[key] != value:
-            self.parent.sendCommand("VALUE {} {}".format(key, value))
+            self.parent.queueCommand(f"VALUE {key} {value}")
             self._vals[key] = value
 
     def __getitem__(self, key):
-        key = key.upper()
-        return self._vals[key]
+        return self._vals[_upper_key(key)]
 
     def __delitem__(self, key):
-        key = key.upper()
-        self.parent.sendCommand("CANCEL VALUE {}".format(key))
+        key = _upper_key(key)
+        self.parent.queueCommand(f"CANCEL VALUE {key}")
         del self._vals[key]
 
     def __iter__(self):
@@ -113,7 +145,7 @@ class Values(MutableMapping):
         return len(self._vals)
 
     def clearAll(self):
-        self.parent.sendCommand("CANCEL VALUE ALL")
+        self.parent.queueCommand("CANCEL VALUE ALL")
         self._vals = dict()
 
 
@@ -153,6 +185,10 @@ class IsotropySession:
             for now the setting options can only be set
             when creating an Isotropy object, not changed later
         """
+        # VALUE/SHOW commands waiting to be written along with the next command
+        self._pending_commands = []
+        # sessions kept ready for restart_session, created on the first restart
+        self._pool = None
         iso_location = os.environ.get('ISOLOCATION')
         logger.debug("""starting isotropy session in {}
                         using isotropy in: {}""".format(
@@ -169,8 +205,8 @@ class IsotropySession:
         while keep_reading:
             # this_line = self.iso_process.stdout.readline().decode()
             this_line = self.read_iso_line()
-            if this_line: # don't log until isotropy responds
-                logger.debug("isotropy: {}".format(this_line))
+            if this_line and logger.isEnabledFor(logging.DEBUG): # don't log until isotropy responds
+                logger.debug("isotropy: %s", this_line)
             if this_line == 'Current setting is International (new ed.) with conventional basis vectors.':
                 keep_reading = False
 
@@ -180,8 +216,8 @@ class IsotropySession:
         self.page = "999"
         self.sendCommand("PAGE {}".format(self.page))
         if setting:
-            if type(setting) == list:
-                self.setting = setting
+            if isinstance(setting, (list, tuple)):
+                self.setting = list(setting)
             else:
                 self.setting = [setting]
         else:
@@ -196,6 +232,8 @@ class IsotropySession:
 
     def __exit__(self, exec_type, exc_value, exc_traceback):
         self.sendCommand("QUIT")
+        if self._pool is not None:
+            self._pool.close()
 
     def restart_session(self):
         try:
@@ -207,16 +245,51 @@ class IsotropySession:
         logger.warning("removing iso db files {}".format(files_to_remove))
         for f in files_to_remove:
             os.remove(f)
-        self.__init__(values=self.values, shows=self.shows,
-                      labels=None, setting=self.setting) # TODO: update if labels implemented
+        # switch to an already started isotropy process and start
+        # another in the background for the next restart
+        if self._pool is None:
+            self._pool = _IsotropySessionPool(setting=self.setting)
+        standby = self._pool.get()
+        self._pool.refill()
+        self._pending_commands = []
+        self.iso_process = standby.iso_process
+        # TODO: update if labels implemented
+        self.values = Values(self, self.values)
+        self.shows = Shows(self, self.shows)
+
+    def queueCommand(self, command):
+        """queue a command to be written to isotropy together with the next sendCommand"""
+        self._pending_commands.append(command)
+
+    def _writeCommands(self, commands):
+        if logger.isEnabledFor(logging.DEBUG):
+            for c in commands:
+                logger.debug('python: %s', c)
+        self.iso_process.stdin.write(bytes(''.join(c + "\n" for c in commands), "ascii"))
+        self.iso_process.stdin.flush()
 
     def sendCommand(self, command):
+        """send any queued commands in a single write, then command"""
+        pending = self._pending_commands
+        self._pending_commands = []
         # read the '*' that indicates the prompt so they don't build up
         this_line = self.read_iso_line()
         # logger.debug("reading *: {}".format(this_line))
-        logger.debug(f'python: {command}')
-        self.iso_process.stdin.write(bytes(command + "\n", "ascii"))
-        self.iso_process.stdin.flush()
+        if pending:
+            self._writeCommands(pending)
+            # queued commands only print a prompt, read all of them before sending
+            # command so none are left to mix with its output
+            # (prompts written back to back may be read together, so count the '*'s)
+            prompts = 0
+            empty_reads = 0
+            while prompts < len(pending) and empty_reads < 50:
+                this_line = self.read_iso_line()
+                if this_line:
+                    prompts += this_line.count('*')
+                    empty_reads = 0
+                else:
+                    empty_reads += 1
+        self._writeCommands([command])
 
     def getDisplayData(self, display, raw=False, delay=None):
         """
@@ -236,54 +309,59 @@ class IsotropySession:
             this_line = self.read_iso_line()
             if this_line in ['*', '']:  # if there is no output '' is returned above
                 keep_reading = False
-            elif re.match(".*You have requested information about .*", this_line):
+            elif _MSG_REQUESTED in this_line:
                 self.read_iso_line() # read past irrep:...
                 self.read_iso_line() # read past The data base for these...
                 self.read_iso_line() # read past Should this...
                 self.read_iso_line() # read past Enter RETURN
-                self.sendCommand("")
-                self.read_iso_line() # read past Adding
-                for i in range(10):
-                    possibly_blank = self.read_iso_line()
-                    if not (possibly_blank in ['*', '']):  # if there is no output '' is returned above
-                        logger.debug("moved past data base prompt, adding results")
-                        lines.append(possibly_blank)
-                        break
-                    else:
-                        if i == 9:
-                            logger.debug("moved past data base prompt, no results")
-            elif re.match(".*Data base for these coupled subgroups .*", this_line):
+                first_result = self._consume_db_prompt()
+                if first_result is not None:
+                    lines.append(first_result)
+            elif _MSG_COUPLED_DB in this_line:
                 self.read_iso_line() # read past Should this...
                 self.read_iso_line() # read past Enter RETURN
-                self.sendCommand("")
-                self.read_iso_line() # read past Adding
-                for i in range(10):
-                    possibly_blank = self.read_iso_line()
-                    if not (possibly_blank in ['*', '']):  # if there is no output '' is returned above
-                        logger.debug("moved past data base prompt, adding results")
-                        lines.append(possibly_blank)
-                        break
-                    else:
-                        if i == 9:
-                            logger.debug("moved past data base prompt, no results")
+                first_result = self._consume_db_prompt()
+                if first_result is not None:
+                    lines.append(first_result)
             else:
                 lines.append(this_line)
         if not raw:
             return self._parse_output(lines)
         return lines
 
+    def _consume_db_prompt(self):
+        """
+        answer isotropy's prompt to add results to its data base and move past
+        the blank lines/prompts that follow, returns the first line of results
+        (None if there are none)
+        """
+        self.sendCommand("")
+        self.read_iso_line() # read past Adding
+        for _ in range(10):
+            # blank lines and prompts can't contain an error, so the checks
+            # in read_iso_line are only done once a line is kept
+            possibly_blank = self._readline()
+            if possibly_blank not in ['*', '']:  # if there is no output '' is returned
+                logger.debug("moved past data base prompt, adding results")
+                return self._check_iso_line(possibly_blank)
+        logger.debug("moved past data base prompt, no results")
+        return None
+
+    def _readline(self):
+        return self.iso_process.stdout.readline().decode().rstrip('\n')
+
     def read_iso_line(self):
-        raw = self.iso_process.stdout.readline().decode()
-        this_line = raw.rstrip('\n')
-        logger.debug("isotropy: {}".format(this_line))
-        if re.match('.*program\shas\sbombed.*',
-                    this_line):
+        return self._check_iso_line(self._readline())
+
+    def _check_iso_line(self, this_line):
+        """log a line from isotropy and raise if it reports an error"""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("isotropy: %s", this_line)
+        if _MSG_BOMB in this_line:
             raise IsotropyBombedException()
-        if re.match(".*Basis\svectors\sare\snot\sa\sright\-handed\sset.*",
-                    this_line):
+        if _MSG_BASIS in this_line:
             raise IsotropyBasisException()
-        if re.match(".*not\sall\selements\sof\sthe\ssubgroup\sare\selements\sof\sparent\sgroup.*",
-                    this_line):
+        if _MSG_SUBGRP in this_line:
             raise IsotropySubgroupException()
         return this_line
 
@@ -296,70 +374,181 @@ class IsotropySession:
         return parsed_output
 
 
-def detect_data_form_and_convert(prop):
-    # if it is a list operate on each element
-    if isinstance(prop, list):
-        return [detect_data_form_and_convert(p) for p in prop]
+class _IsotropySessionPool:
+    """
+    Keeps an isotropy session started in the background so that
+    IsotropySession.restart_session doesn't have to wait on isotropy starting up
+    """
+    def __init__(self, setting=None):
+        self.setting = setting
+        self._standby = None
+        self._thread = None
+
+    def _start_standby(self):
+        try:
+            self._standby = IsotropySession(setting=self.setting)
+        except Exception:
+            logger.warning("couldn't start standby isotropy session", exc_info=True)
+
+    def refill(self):
+        """start a standby session in the background if there isn't one"""
+        if self._thread is None and self._standby is None:
+            self._thread = threading.Thread(target=self._start_standby, daemon=True)
+            self._thread.start()
+
+    def get(self):
+        """return the standby session, or start one if there is none"""
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        session, self._standby = self._standby, None
+        if session is None:
+            session = IsotropySession(setting=self.setting)
+        return session
+
+    def close(self):
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._standby is not None:
+            self._standby.__exit__(None, None, None)
+            self._standby = None
+
+
+def _split_outside_paren(prop, sep):
+    """
+    split prop at sep (and any whitespace following it), skipping any sep
+    inside paren, i.e. where the next paren after sep is a closing one
+    """
+    pieces = []
+    start = 0
+    i = prop.find(sep)
+    while i != -1:
+        close = prop.find(')', i + 1)
+        if close == -1 or -1 < prop.find('(', i + 1, close):
+            pieces.append(prop[start:i])
+            start = i + 1
+            while start < len(prop) and prop[start].isspace():
+                start += 1
+        i = prop.find(sep, i + 1)
+    pieces.append(prop[start:])
+    return pieces
+
+def _paren_contents(prop):
+    """contents of each (non-empty) paren in prop, like re.findall(r'\\((.+?)\\)', prop)"""
+    contents = []
+    pos = 0
+    while True:
+        opening = prop.find('(', pos)
+        if opening == -1:
+            break
+        closing = prop.find(')', opening + 2)
+        if closing == -1:
+            break
+        contents.append(prop[opening + 1:closing])
+        pos = closing + 1
+    return contents
+
+def _split_prop(prop):
+    """
+    split a single string from isotropy one level, returns a list of the
+    pieces, or a string if prop isn't split (but may have been unwrapped)
+    """
     # first split by '|'s (but not '|'s inside paren)
-    pipe_split_list = re.split(r'[|]\s*(?![^()]*\))', prop)
-    if len(pipe_split_list) > 1:
-        return detect_data_form_and_convert(pipe_split_list)
+    if '|' in prop:
+        pipe_split_list = _split_outside_paren(prop, '|')
+        if len(pipe_split_list) > 1:
+            return pipe_split_list
     # first split by commas (but not commas inside paren)
-    comma_split_list = re.split(r'[,]\s*(?![^()]*\))', prop)
-    if len(comma_split_list) > 1:
-        return detect_data_form_and_convert(comma_split_list)
+    if ',' in prop:
+        comma_split_list = _split_outside_paren(prop, ',')
+        if len(comma_split_list) > 1:
+            return comma_split_list
     # remove paren if entirely surrounded in paren with no inner paren
     # return list of paren surrouned bits if there are multiple
-    if re.match(r'^\s*\(.*\)$', prop): # \s is new (4/16/19), should be tested
-        surrounded_by_paren_list = re.findall(r'\((.+?)\)', prop)
+    if prop.endswith(')') and prop.lstrip().startswith('('):
+        surrounded_by_paren_list = _paren_contents(prop)
         if len(surrounded_by_paren_list) > 1:
-            return detect_data_form_and_convert(surrounded_by_paren_list)
-        return detect_data_form_and_convert(surrounded_by_paren_list[0])
+            return surrounded_by_paren_list
+        return surrounded_by_paren_list[0]
     # next split by spaces
     space_split_list = prop.split()
     if len(space_split_list) > 1:
-        return detect_data_form_and_convert(space_split_list)
+        return space_split_list
     # we leave numbers as strings for ease of giving them
     # back to isotropy (which often wants fractions)
     # they can be converted where needed
 
     # finally just remove outer whitespace
-    return prop.strip()
+    return None
+
+def detect_data_form_and_convert(prop):
+    # if it is a list operate on each element
+    if isinstance(prop, list):
+        return [detect_data_form_and_convert(p) for p in prop]
+    # strings are split level by level until nothing more can be split,
+    # using a stack of (string, list it goes in, index in that list)
+    # rather than recursing for every level
+    result = [None]
+    stack = [(prop, result, 0)]
+    while stack:
+        this_prop, container, index = stack.pop()
+        split = _split_prop(this_prop)
+        if split is None:
+            container[index] = this_prop.strip()
+        elif isinstance(split, str):
+            # unwrapped from paren, needs to be split again
+            stack.append((split, container, index))
+        else:
+            container[index] = pieces = [None] * len(split)
+            stack.extend((piece, pieces, i) for i, piece in enumerate(split))
+    return result[0]
 
 def detect_multirows_and_split(split_lines):
+    # isotropy printed nothing
+    if not split_lines:
+        return []
+    headers = split_lines[0]
     result_list = []
+    # every property is collected in a list, properties only found
+    # on one row are taken out of their list at the end
     for row in split_lines[1:]:
         if row[0]:
             result = {}
             result_list.append(result)
-        for j, prop in enumerate(row):
-            if row[0]:
-                result[split_lines[0][j]] = prop
-            elif prop:
-                if isinstance(result[split_lines[0][j]], list):
-                    result[split_lines[0][j]].append(prop)
-                else:
-                    result[split_lines[0][j]] = [result[split_lines[0][j]], prop]
-    return result_list
+            for key, prop in zip(headers, row):
+                result[key] = [prop]
+        else:
+            for key, prop in zip(headers, row):
+                if prop:
+                    result[key].append(prop)
+    return [{key: props[0] if len(props) == 1 else props
+             for key, props in result.items()}
+            for result in result_list]
 
 def detect_column_indexes(list_of_lines):
-    indexes = [0]
-    transitions = [col.count(' ') == len(list_of_lines) for col in zip(*list_of_lines)]
-    last = False
-    for i, x in enumerate(transitions):
-        if (not x
-            and last
-            and list_of_lines[0][i] != ' '):
-            #and all(line[i] != ' ' for line in list_of_lines[1:])):
-            # the above commented condition breaks Matricies (where the actual matrix is indented past header)
-            # but fixes cases where both the header label has spaces and is longer than the actual data
-            # if this indentation only happens for matricies we can apply a fix to that special case
-            # another case where this can be an issue seems to be with directions of domains
-            # example above condition is useful:
-            # shows = ['irrep', 'kpoint'], then getDisplayData('irrep')
-            indexes.append(i)
-        last = x
-    return indexes
+    if not list_of_lines:
+        return [0]
+    # only columns present in every line are considered (as zip(*lines) would)
+    ncols = min(len(line) for line in list_of_lines)
+    if ncols == 0:
+        return [0]
+    chars = np.frombuffer(''.join(line[:ncols] for line in list_of_lines).encode('ascii', 'replace'),
+                          dtype=np.uint8).reshape(len(list_of_lines), ncols)
+    is_space = chars == 0x20
+    all_space_col = is_space.all(axis=0)
+    # a new column starts where an all space column is followed by one that isn't
+    # and the header has a character there
+    starts = np.zeros(ncols, dtype=bool)
+    starts[1:] = all_space_col[:-1] & ~all_space_col[1:] & ~is_space[0, 1:]
+    # the header condition could instead require every line to be non space here,
+    # but that breaks Matricies (where the actual matrix is indented past header)
+    # though it would fix cases where both the header label has spaces and is longer than the actual data
+    # if this indentation only happens for matricies we can apply a fix to that special case
+    # another case where this can be an issue seems to be with directions of domains
+    # example the stricter condition is useful:
+    # shows = ['irrep', 'kpoint'], then getDisplayData('irrep')
+    return [0] + np.nonzero(starts)[0].tolist()
 
 def split_line_by_indexes(indexes, line):
     tokens = []
@@ -368,7 +557,36 @@ def split_line_by_indexes(indexes, line):
     tokens.append(line[indexes[-1]:].rstrip())
     return tokens
 
+# use the compiled parser if it was built, otherwise the versions above
+try:
+    from ._parser import (detect_data_form_and_convert, detect_multirows_and_split,
+                          detect_column_indexes, split_line_by_indexes)
+except ImportError:
+    pass
+
+def _hashable_setting(setting):
+    """settings given as a list are turned in to a tuple so they can be used as a cache key"""
+    if isinstance(setting, list):
+        return tuple(setting)
+    return setting
+
+def clear_iso_caches():
+    """forget all cached results of isotropy queries"""
+    _getSymOps.cache_clear()
+    _getKpoints.cache_clear()
+    _getIrreps.cache_clear()
+    _equivalent_basis_origins.cache_clear()
+
 def getSymOps(spacegroup, with_matrix=False, lattice_param='1 1 1 90 90 90', setting=None):
+    # results are cached, so hand back a copy the caller is free to modify
+    return deepcopy(_getSymOps(spacegroup, with_matrix, lattice_param,
+                               _hashable_setting(setting)))
+
+# rotation matrix and translation of a symop as float arrays
+SymOpMatrix = namedtuple('SymOpMatrix', ['rot', 'trans'])
+
+@lru_cache(maxsize=None)
+def _getSymOps(spacegroup, with_matrix, lattice_param, setting):
     values = {'parent': spacegroup}
     shows = ['elements']
     with IsotropySession(values, shows, setting=setting) as isos:
@@ -376,18 +594,44 @@ def getSymOps(spacegroup, with_matrix=False, lattice_param='1 1 1 90 90 90', set
             isos.values['lattice parameter'] = lattice_param
             isos.shows.add('cartesian')
             symOps = isos.getDisplayData('parent')
+            # parse the matrices once here rather than every time they're used
+            for symop in symOps:
+                mat = symop['Rotation matrix, translation']
+                symop['Rotation matrix, translation'] = SymOpMatrix(
+                    rot=_list_to_float_array(mat[:3]).reshape(3, 3),
+                    trans=_list_to_float_array(mat[3]).reshape(3))
         else:
             symOps = isos.getDisplayData('parent')[0]['Elements']
     return symOps
 
-def getKpoints(spacegroup, setting=None):
-    values = {'parent': spacegroup}
-    shows = ['kpoint']
-    with IsotropySession(values, shows, setting=setting) as isos:
-        kpoints = isos.getDisplayData('kpoint')
-        kpt_dict = {kpt['']: tuple(kpt['k vector']) for kpt in kpoints}
+def getKpoints(spacegroup, setting=None, isos=None):
+    if isos is not None:
+        return _kpoints_from_session(isos, spacegroup)
+    return dict(_getKpoints(spacegroup, _hashable_setting(setting)))
+
+@lru_cache(maxsize=None)
+def _getKpoints(spacegroup, setting):
+    with IsotropySession(setting=setting) as isos:
+        kpt_dict = _kpoints_from_session(isos, spacegroup)
     return kpt_dict
 
+def _show_only(isos, item):
+    """
+    make item the only thing shown in isos, as in a fresh session
+    (other shows can confuse the column detection, e.g. irrep with kpoint)
+    """
+    if set(isos.shows) != {_upper_key(item)}:
+        isos.shows.clearAll()
+        isos.shows.add(item)
+
+def _kpoints_from_session(isos, spacegroup):
+    isos.values['parent'] = spacegroup
+    if 'kpoint' in isos.values:
+        del isos.values['kpoint']
+    _show_only(isos, 'kpoint')
+    kpoints = isos.getDisplayData('kpoint')
+    return {kpt['']: tuple(kpt['k vector']) for kpt in kpoints}
+
 def _kpt_has_params(kpt):
     try:
         _list_to_float_array(kpt)
@@ -395,23 +639,34 @@ def _kpt_has_params(kpt):
         return True
     return False
 
-def getIrreps(spacegroup, kpoint=None, setting=None):
-    values = {'parent': spacegroup}
-    if kpoint:
-        values['kpoint'] = kpoint
-    shows = ['irrep']
-    with IsotropySession(values, shows, setting=setting) as isos:
-        results = isos.getDisplayData('irrep')
-        irreps = [ir['Irrep (ML)'] for ir in results]
+def getIrreps(spacegroup, kpoint=None, setting=None, isos=None):
+    if isos is not None:
+        return _irreps_from_session(isos, spacegroup, kpoint)
+    return list(_getIrreps(spacegroup, kpoint, _hashable_setting(setting)))
+
+@lru_cache(maxsize=None)
+def _getIrreps(spacegroup, kpoint, setting):
+    with IsotropySession(setting=setting) as isos:
+        irreps = _irreps_from_session(isos, spacegroup, kpoint)
     return irreps
 
+def _irreps_from_session(isos, spacegroup, kpoint):
+    isos.values['parent'] = spacegroup
+    if kpoint:
+        isos.values['kpoint'] = kpoint
+    elif 'kpoint' in isos.values:
+        del isos.values['kpoint']
+    _show_only(isos, 'irrep')
+    results = isos.getDisplayData('irrep')
+    return [ir['Irrep (ML)'] for ir in results]
+
 def getDirections(spacegroup, basis, origin, subgroup=None, setting=None, extra_values=None, extra_shows=None):
     if subgroup is None:
         subgroup = 1
     values = {'parent': spacegroup,
               'subgroup': subgroup,
               'basis': _matrix_to_iso_string(basis),
-              'origin': ','.join([str(Fraction(i).limit_denominator(10)) for i in origin])}
+              'origin': ','.join([_frac_str(i) for i in origin])}
     shows = ['kpoint']
     if extra_values is not None:
         values.update(extra_values)
@@ -422,24 +677,29 @@ def getDirections(spacegroup, basis, origin, subgroup=None, setting=None, extra_
     return directions
 
 def getRepresentations(spacegroup, kpoint_label, irreps=None, setting=None):
-    elements = getSymOps(spacegroup, setting)
+    elements = getSymOps(spacegroup, setting=setting)
     if not irreps:
         irreps = getIrreps(spacegroup, kpoint_label, setting)
     values = {'parent': spacegroup, 'kpoint': kpoint_label}
     shows = ['matrix']
+    elem_strs = ['{} {}'.format(element[0], ' '.join(element[1]))
+                 for element in elements]
     irrep_dict = {}
     with IsotropySession(values, shows, setting=setting) as isos:
         for irrep in irreps:
             isos.values['irrep'] = irrep
-            mat_list = []
-            for element in elements:
-                elem_str = '{} {}'.format(element[0],
-                                          ' '.join(element[1]))
+            # matrices for an irrep are stacked in one (n_elements, d, d) array
+            # d differs between irreps so each irrep gets its own array
+            mats = None
+            for i, elem_str in enumerate(elem_strs):
                 isos.values['element'] = elem_str
                 res = isos.getDisplayData('irrep')[0]
-                matrix = res['Matrix'] # unlike previous version leaving elements as strings
-                mat_list.append(matrix)
-            irrep_dict[irrep] = mat_list
+                matrix = _list_to_float_array(res['Matrix'])
+                if mats is None:
+                    d = int(round(np.sqrt(matrix.size)))
+                    mats = np.empty((len(elem_strs), d, d))
+                mats[i] = matrix.reshape(d, d)
+            irrep_dict[irrep] = mats
     return irrep_dict
 
 def getDomains(parent, irrep, direction=None, setting=None, extra_shows=[], extra_values={}, isos=None, k_params=None):
@@ -500,8 +760,35 @@ def getDistortion(parent, wyckoffs, irrep, direction=None, cell=None, k_params=N
     # this currently is not done
     return dist
 
+@lru_cache(maxsize=4096)
+def _frac_str(number):
+    """string of number as a fraction with denominator of at most 10"""
+    try:
+        return _FRAC10_TABLE[round(number, 6)]
+    except (KeyError, TypeError):
+        return str(Fraction(number).limit_denominator(10))
+
+def _exact_frac_str(number):
+    """string of number as an exact fraction"""
+    try:
+        return _EXACT_FRAC_TABLE[number]
+    except (KeyError, TypeError):
+        return str(Fraction(number))
+
 def _matrix_to_iso_string(mat):
-    return ' '.join([','.join([str(Fraction(i)) for i in r]) for r in mat])
+    return ' '.join([','.join([_exact_frac_str(i) for i in r]) for r in mat])
+
+def _canon_value(value):
+    """string to send isotropy for value, vectors and matrices are written as fractions"""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (list, tuple, np.ndarray)):
+        ndim = np.ndim(value)
+        if ndim == 2:
+            return _matrix_to_iso_string(value)
+        if ndim == 1:
+            return ','.join([_frac_str(i) for i in value])
+    return str(value)
 
 def _to_float(number):
     try:
@@ -512,6 +799,11 @@ def _to_float(number):
 def _list_to_float_array(sl):
     """return float array of (possibly nested) list of strings (or ints/floats) where
     strings can have fractions (i.e. 1/2 will be converted to 0.5)"""
+    # numpy can convert it directly unless there are fractions
+    try:
+        return np.asarray(sl, dtype=float)
+    except ValueError:
+        pass
     result = []
     for i in sl:
         if isinstance(i, (list, np.ndarray)):
@@ -524,17 +816,27 @@ def _find_all_equivalent_basis_origin(parent, basis, origin):
     basis = _list_to_float_array(basis)
     origin = _list_to_float_array(origin)
     # we follow a convention that all origin choices are positive with each componenet < 1
-    origin = np.array([i % 1 for i in origin])
+    origin = np.mod(origin, 1.)
+    possible_basis_origins = _equivalent_basis_origins(parent,
+                                                       tuple(map(tuple, basis)),
+                                                       tuple(origin))
+    # results are cached, so hand back copies the caller is free to modify
+    return [(b.copy(), o.copy()) for b, o in possible_basis_origins]
+
+@lru_cache(maxsize=None)
+def _equivalent_basis_origins(parent, basis, origin):
+    basis = np.array(basis)
+    origin = np.array(origin)
     symOps = getSymOps(parent, with_matrix=True)
-    possible_basis_origins = []
-    for symop in symOps:
-        rot = _list_to_float_array(symop['Rotation matrix, translation'][:3])
-        trans = _list_to_float_array(symop['Rotation matrix, translation'][3])
-        new_basis = np.array([np.dot(rot, vec) + trans for vec in basis])
-        new_origin = np.dot(rot, origin) + trans
-        # we follow a convention that all origin choices are positive with each componenet < 1
-        new_origin = np.array([i % 1 for i in new_origin])
-        possible_basis_origins.append((new_basis, new_origin))
+    if not symOps:
+        return []
+    # stack all symops so they are applied with one einsum each for basis and origin
+    rots = np.array([symop['Rotation matrix, translation'].rot for symop in symOps])
+    trans = np.array([symop['Rotation matrix, translation'].trans for symop in symOps])
+    new_bases = np.einsum('nij,bj->nbi', rots, basis) + trans[:, None, :]
+    # we follow a convention that all origin choices are positive with each componenet < 1
+    new_origins = np.mod(np.einsum('nij,j->ni', rots, origin) + trans, 1.)
+    possible_basis_origins = list(zip(new_bases, new_origins))
     # commented line below would remove duplicates, but it might not be worth it
     # no_dupes = list({np.array(bo[0] + bo[1]).tostring(): bo
     #                      for bo in possible_basis_origins}.values())
@@ -548,22 +850,53 @@ def getPossibleSingleIrrepOPs(parent, subgroup):
         # TODO: cleanup the (ML) for consistency
     return possible_ops
 
-def getPossibleIrrepComboOPs(parent, subgroup=None, irreps=None, n=2):
-    if irreps is None:
-        # try all irreps that don't have kpt with free parameter
-        kpts = getKpoints(parent)
-        irreps = []
-        for kpt, vec in kpts.items():
-            if not _kpt_has_params(vec):
-                irreps += getIrreps(parent, kpoint=kpt)
+def _irreps_by_kpoint(parent, isos):
+    """irreps of parent for each kpoint which doesn't have a free parameter"""
+    irreps_by_kpt = {}
+    for kpt, vec in getKpoints(parent, isos=isos).items():
+        if not _kpt_has_params(vec):
+            irreps_by_kpt[kpt] = getIrreps(parent, kpoint=kpt, isos=isos)
+    if 'kpoint' in isos.values:
+        del isos.values['kpoint']
+    isos.shows.clearAll()
+    return irreps_by_kpt
+
+def getPossibleIrrepComboOPs(parent, subgroup=None, irreps=None, n=2, same_kpoint=False):
+    """
+    Args:
+    parent: parent spacegroup
+    subgroup (optional): only return OPs leading to this subgroup
+    irreps (optional): irreps to combine, by default all irreps
+        at kpoints without free parameters
+    n: number of irreps coupled together
+    same_kpoint (optional): only try combinations of irreps at the same kpoint,
+        this greatly cuts down the number of queries but will miss any coupling
+        of irreps at different kpoints (e.g. M3+ and R4+ in perovskites)
+    """
     possible_ops = []
-    values = {'parent': parent}
-    if subgroup is not None:
-        values['subgroup'] = subgroup
     shows = ['irrep', 'direction', 'basis', 'origin']
     # last_combo = None
-    with IsotropySession(values, shows) as isos:
-        for combo in combinations(irreps, n):
+    # one session is used both to find the irreps and to try their combinations
+    with IsotropySession({'parent': parent}) as isos:
+        if irreps is None or same_kpoint:
+            irreps_by_kpt = _irreps_by_kpoint(parent, isos)
+            if irreps is None:
+                irreps = list(chain.from_iterable(irreps_by_kpt.values()))
+        if same_kpoint:
+            # irreps given whose kpoint isn't known are grouped together
+            kpt_of_irrep = {ir: kpt for kpt, kpt_irreps in irreps_by_kpt.items()
+                            for ir in kpt_irreps}
+            irrep_groups = {}
+            for ir in irreps:
+                irrep_groups.setdefault(kpt_of_irrep.get(ir), []).append(ir)
+            irrep_combos = chain.from_iterable(combinations(group, n)
+                                               for group in irrep_groups.values())
+        else:
+            irrep_combos = combinations(irreps, n)
+        if subgroup is not None:
+            isos.values['subgroup'] = subgroup
+        isos.shows.update(shows)
+        for combo in irrep_combos:
             logger.info(f'trying irrep combo {combo}')
             isos.values['irrep'] = ' '.join(combo)
             try:
@@ -598,16 +931,23 @@ def getPossibleIrrepComboOPs(parent, subgroup=None, irreps=None, n=2):
             #     logger.warning("this combo reparsed data:\n{}".format(this_combo_data))
             for op in this_combo_data:
                 op["Irreps"] = combo
-            logger.debug("parsed: {}".format(this_combo_data))
+            logger.debug("parsed: %s", this_combo_data)
             possible_ops.extend(this_combo_data)
             # last_combo = combo
     return possible_ops
 
-def _in_basis_permutations(basis_a, basis_b):
-    for b in permutations(basis_a):
-        if (abs(basis_b - b) < 1e-5).all():
-            return True
-    return False
+def _canonical_basis(basis):
+    """basis vectors sorted lexicographically, so bases which are permutations
+    of each other have the same canonical form"""
+    basis = np.asarray(basis, dtype=float)
+    return basis[np.lexsort(np.round(basis, 5).T)]
+
+def _in_basis_permutations(basis_a, basis_b, canonical_a=None):
+    if canonical_a is None:
+        canonical_a = _canonical_basis(basis_a)
+    canonical_b = _canonical_basis(basis_b)
+    return (canonical_a.shape == canonical_b.shape
+            and (abs(canonical_b - canonical_a) < 1e-5).all())
 
 def getPossibleOPs_for_basis(parent, subgroup, basis, origin, coupled_order=2):
     single_ops = getPossibleSingleIrrepOPs(parent, subgroup)
@@ -619,11 +959,13 @@ def getPossibleOPs_for_basis(parent, subgroup, basis, origin, coupled_order=2):
     ops_to_check = single_ops + coupled_ops
     #equivalent_basis = _find_all_equivalent_basis_origin(parent, basis, origin)
     compatible_ops = []
+    canonical_basis = _canonical_basis(basis[0])
     for op in ops_to_check:
         this_basis = _list_to_float_array(op['Basis Vectors'])
         this_origin = _list_to_float_array(op['Origin']) # assumed to have all 0<x_i<1 for each i
         if (abs(this_origin - basis[1]) < 1e-5).all() and _in_basis_permutations(basis[0],
-                                                                                 this_basis):
+                                                                                 this_basis,
+                                                                                 canonical_basis):
             compatible_ops.append(op)
     return compatible_ops
 
@@ -10,9 +10,13 @@ import numpy as np
 from pymatgen.analysis.structure_matcher import StructureMatcher
 from pymatgen.core.lattice import Lattice
 from pymatgen.util.coord import lattice_points_in_supercell
-from pymatgen.optimization.linear_assignment import LinearAssignment  # type: ignore
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import maximum_bipartite_matching
 from pymatgen.core.structure import Structure
 
+_I3 = np.identity(3)
+
 
 def _get_lattices(self, target_lattice, s, supercell_size=1, rh_only=False):
     """
@@ -35,13 +39,16 @@ def _get_lattices(self, target_lattice, s, supercell_size=1, rh_only=False):
             yield l, scale_m
 
 
-def _get_supercells(self, struct1, struct2, fu, s1_supercell, rh_only=False):
+def _get_supercells(self, struct1, struct2, fu, s1_supercell, rh_only=False, identity_only=False):
     """
     Computes all supercells of one structure close to the lattice of the
     other
     if s1_supercell == True, it makes the supercells of struct1, otherwise
     it makes them of s2
 
+    if identity_only == True, only supercells with an identity
+    supercell_matrix are made (others are skipped before computing coords)
+
     yields: s1, s2, supercell_matrix, average_lattice, supercell_matrix
     """
 
@@ -55,12 +62,16 @@ def _get_supercells(self, struct1, struct2, fu, s1_supercell, rh_only=False):
         if fu == 1:
             cc = np.array(s1.cart_coords)
             for l, sc_m in self._get_lattices(s2.lattice, s1, fu, rh_only=rh_only):
+                if identity_only and not np.array_equal(sc_m, _I3):
+                    continue
                 fc = l.get_fractional_coords(cc)
                 fc -= np.floor(fc)
                 yield fc, s2_fc, av_lat(l, s2.lattice), sc_m
         else:
             fc_init = np.array(s1.frac_coords)
             for l, sc_m in self._get_lattices(s2.lattice, s1, fu, rh_only=rh_only):
+                if identity_only and not np.array_equal(sc_m, _I3):
+                    continue
                 fc = np.dot(fc_init, np.linalg.inv(sc_m))
                 lp = lattice_points_in_supercell(sc_m)
                 fc = (fc[:, None, :] + lp[None, :, :]).reshape((-1, 3))
@@ -76,6 +87,26 @@ def _get_supercells(self, struct1, struct2, fu, s1_supercell, rh_only=False):
             yield x[1], x[0], x[2], x[3]
 
 
+def _has_full_matching(mask):
+    """
+    Whether every row of mask (True where sites can't be mapped) can be
+    assigned to a different column where mask is False.
+
+    A dense assignment is used unless there are many sites with few allowed
+    pairs, where matching them as a sparse graph is faster.
+    """
+    n_rows, n_cols = mask.shape
+    if n_rows == 0:
+        return True
+    allowed = ~mask
+    if n_rows < 200 or allowed.sum() > 0.1 * n_rows * n_cols:
+        r, c = linear_sum_assignment(mask.astype(np.float64))
+        return not mask[r, c].any()
+    # column matched to each row, -1 if a row can't be matched
+    matching = maximum_bipartite_matching(csr_matrix(allowed), perm_type='column')
+    return bool((matching >= 0).all())
+
+
 def _strict_match(self, struct1, struct2, fu, s1_supercell=True,
                   use_rms=False, break_on_match=False, rh_only=False):
     """
@@ -106,7 +137,7 @@ def _strict_match(self, struct1, struct2, fu, s1_supercell=True,
     if (not self._subset) and mask.shape[1] != mask.shape[0]:
         return None
 
-    if LinearAssignment(mask).min_cost > 0:
+    if not _has_full_matching(mask):
         return None
 
     best_match = None
@@ -215,8 +246,18 @@ def get_s2_like_s1(self, struct1, struct2, include_ignored_species=True, rh_only
     """
     s1, s2 = self._process_species([struct1, struct2])
     trans = self.get_transformation(s1, s2, rh_only=rh_only)
+    return self._s2_like_s1_from_transformation(struct1, struct2, trans,
+                                                include_ignored_species=include_ignored_species)
+
+
+def _s2_like_s1_from_transformation(self, struct1, struct2, trans, include_ignored_species=True):
+    """
+    Same as get_s2_like_s1, but using trans already found by
+    get_transformation(struct1, struct2) instead of matching again.
+    """
     if trans is None:
         return None
+    s1, s2 = self._process_species([struct1, struct2])
     sc, t, mapping = trans
     sites = [site for site in s2]
     # Append the ignored sites at the end.
@@ -247,3 +288,4 @@ def PATCH_StructureMatcher():
     StructureMatcher._strict_match = _strict_match
     StructureMatcher.get_transformation = get_transformation
     StructureMatcher.get_s2_like_s1 = get_s2_like_s1
+    StructureMatcher._s2_like_s1_from_transformation = _s2_like_s1_from_transformation
@@ -1,17 +1,20 @@
 #!/usr/bin/env python
 import sys
 import logging
+import queue
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from fractions import Fraction
 import numpy as np
 from pymatgen.core import Structure, Lattice
 from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
 from pymatgen.analysis.structure_matcher import StructureMatcher
-from pymatgen.optimization.linear_assignment import LinearAssignment
 import pysotropy as iso
-from sympy import sympify, linsolve, EmptySet
+from sympy import sympify, linsolve, linear_eq_to_matrix, lambdify, EmptySet
+from sympy.solvers.solveset import NonlinearError
 from sympy.parsing.sympy_parser import (parse_expr, standard_transformations,
                                         implicit_multiplication_application)
-from pysotropy.patches import PATCH_StructureMatcher
+from pysotropy.patches import PATCH_StructureMatcher, _has_full_matching
 PATCH_StructureMatcher()
 # logger = logging.getLogger("pysotropy")
 logger = logging.getLogger(__name__)
@@ -26,27 +29,31 @@ class OtherDirectionError(Exception):
     """Raised when Isotropy Bombs"""
     pass
 
+def make_frac_converter(lat1, lat2):
+    """function converting (rows of) frac coords of lat 1 to frac coords of lat2"""
+    transform = np.dot(lat1.matrix, lat2.inv_matrix)
+    return lambda vec: np.dot(vec, transform)
+
 def frac_vec_convert(vec, lat1, lat2):
     """convert from frac coords of lat 1 to frac coords of lat2"""
-    cart = lat1.get_cartesian_coords(vec)
-    return lat2.get_fractional_coords(cart)
+    return make_frac_converter(lat1, lat2)(vec)
 
 def smallest_disp(s2, s1):
-    sign = lambda x: 1 if x > 0 else -1 if x < 0 else 0
-    disp  = []
-    for d2, d1 in zip(s2, s1):
-        d = d2 - d1
-        if abs(d) > 0.5:
-            d = d - sign(d)
-        disp.append(d)
-    return disp
+    """displacement(s) from frac coords s1 to s2 with each component in [-0.5, 0.5]"""
+    d = np.asarray(s2) - np.asarray(s1)
+    return d - np.rint(d)
+
+@lru_cache(maxsize=64)
+def _sym_info(matrix, frac_coords, species):
+    sga = SpacegroupAnalyzer(Structure(matrix, species, frac_coords))
+    return sga.get_space_group_number(), tuple(sga.get_symmetry_dataset()['wyckoffs'])
 
 def get_sym_info(struct):
-    """get spacegroup number and wyckoff set"""
-    sga = SpacegroupAnalyzer(struct)
-    sgn = sga.get_space_group_number()
-    wyckoff = sga.get_symmetry_dataset()['wyckoffs']
-    return sgn, wyckoff
+    """get spacegroup number and wyckoff set (cached per structure)"""
+    sgn, wyckoff = _sym_info(tuple(map(tuple, struct.lattice.matrix)),
+                             tuple(map(tuple, struct.frac_coords)),
+                             tuple(struct.species))
+    return sgn, list(wyckoff)
 
 
 class ModifiedSM_I(StructureMatcher):
@@ -85,18 +92,13 @@ class ModifiedSM_I(StructureMatcher):
         if not self._subset and mask.shape[1] != mask.shape[0]:
             return None
 
-        if LinearAssignment(mask).min_cost > 0:
+        if not _has_full_matching(mask):
             return None
 
         best_match = None
         # loop over all lattices
         for s1fc, s2fc, avg_l, sc_m in \
-                self._get_supercells(struct1, struct2, fu, s1_supercell):
-
-            if not (sc_m==np.identity(3)).all():
-            #if not (sc_m[-1]==np.identity(3)[-1]).all():
-                continue
-
+                self._get_supercells(struct1, struct2, fu, s1_supercell, identity_only=True):
             # compute fractional tolerance
             normalization = (len(s1fc) / avg_l.volume) ** (1/3)
             inv_abc = np.array(avg_l.reciprocal_lattice.abc)
@@ -132,19 +134,19 @@ def match_structures(s1, s2, scale_lattice=False, rh_only=True):
     Returns
         basis: should be the basis that when applied to s1 makes a supercell of the size and orentation of s2
         origin: any additional translation to best match (applied before applying the basis change to match what isotropy does)
-        displacements
+        displacements: (N, 3) array of frac displacements of each site
         high_sym_supercell
 """
     sm = StructureMatcher(ltol=0.3, stol=0.3, angle_tol=15, scale=True, attempt_supercell=True, primitive_cell=False)
-    basis, origin, mapping = sm.get_transformation(s1, s2, rh_only=rh_only)
+    # match once, get_s2_like_s1 would repeat the same search
+    trans = sm.get_transformation(s1, s2, rh_only=rh_only)
+    basis, origin, mapping = trans
 
-    struct_hs_supercell = sm.get_s2_like_s1(s1, s2, rh_only=rh_only)
+    struct_hs_supercell = sm._s2_like_s1_from_transformation(s1, s2, trans)
 
     # change origin from the supercell basis to the high sym basis
-    origin = np.round_(frac_vec_convert(origin,
-                                        struct_hs_supercell.lattice,
-                                        s2.lattice),
-                       decimals=5)
+    origin = np.round(make_frac_converter(struct_hs_supercell.lattice, s2.lattice)(origin),
+                      decimals=5)
     if scale_lattice:
         hs_lat = struct_hs_supercell.lattice
         hs_std = Lattice.from_lengths_and_angles(hs_lat.abc, hs_lat.angles)
@@ -156,77 +158,173 @@ def match_structures(s1, s2, scale_lattice=False, rh_only=True):
         struct_hs_supercell = Structure(strained_hs_lattice,
                                             struct_hs_supercell.species,
                                             [site.frac_coords for site in struct_hs_supercell])
-    displacements = []
-    for s_hs, s_ls in zip(struct_hs_supercell, s1):
-        disp = np.round_(smallest_disp(s_hs.frac_coords, s_ls.frac_coords), decimals=5)
-        displacements.append(disp)
+    n_sites = min(len(struct_hs_supercell), len(s1))
+    displacements = np.round(smallest_disp(struct_hs_supercell.frac_coords[:n_sites],
+                                           s1.frac_coords[:n_sites]),
+                             decimals=5)
     return basis, origin, displacements, struct_hs_supercell
 
-def get_all_distortions(sgn_hs, wyckoff_list, directions, basis, origin):
+def get_all_distortions(sgn_hs, wyckoff_list, directions, basis, origin, max_workers=1):
+    """
+    get distortions for each direction, directions are sent to isotropy
+    from up to max_workers sessions at once
+    sessions share the working directory and its *.iso files (which restart_session
+    removes), so only use max_workers > 1 if that is ok
+    """
     directions_dict = {}
     distortions = {}
-    with iso.IsotropySession() as isos:
-        for direct in directions:
-            k_params = None
-            if 'k params' in direct.keys():
-                kp = direct['k params']
-                if len(kp) > 0:
-                    if type(kp) is list:
-                        k_params = kp
-                    else:
-                        k_params = [kp]
-            irrep = direct['Irrep']
-            d = "vector,{}".format(','.join(direct['Dir']))
-            this_dist = iso.getDistortion(sgn_hs, wyckoff_list,
-                                          irrep, cell=basis, origin=origin,
-                                          direction=d, k_params=k_params, isos=isos)
-            if k_params is not None:
-                for wyck in this_dist:
-                    wyck['k_params'] = k_params
-            if len(this_dist) > 0:
-                distortions[irrep] = this_dist
-                directions_dict[irrep] = direct['Dir']
+    if not directions:
+        return distortions, directions_dict
+    max_workers = max(1, min(max_workers, len(directions)))
+
+    def get_distortion(direct, isos):
+        k_params = None
+        if 'k params' in direct.keys():
+            kp = direct['k params']
+            if len(kp) > 0:
+                if type(kp) is list:
+                    k_params = kp
+                else:
+                    k_params = [kp]
+        irrep = direct['Irrep']
+        d = "vector,{}".format(','.join(direct['Dir']))
+        this_dist = iso.getDistortion(sgn_hs, wyckoff_list,
+                                      irrep, cell=basis, origin=origin,
+                                      direction=d, k_params=k_params, isos=isos)
+        return direct, irrep, k_params, this_dist
+
+    if max_workers == 1:
+        with iso.IsotropySession() as isos:
+            results = [get_distortion(direct, isos) for direct in directions]
+    else:
+        # each worker takes a session for its request, new ones are started as needed
+        idle_sessions = queue.Queue()
+        all_sessions = []
+
+        def get_distortion_from_pool(direct):
+            try:
+                isos = idle_sessions.get_nowait()
+            except queue.Empty:
+                isos = iso.IsotropySession()
+                all_sessions.append(isos)
+            try:
+                return get_distortion(direct, isos)
+            finally:
+                idle_sessions.put(isos)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                # results come back in the order of directions
+                results = list(executor.map(get_distortion_from_pool, directions))
+        finally:
+            for isos in all_sessions:
+                isos.__exit__(None, None, None)
+    for direct, irrep, k_params, this_dist in results:
+        if k_params is not None:
+            for wyck in this_dist:
+                wyck['k_params'] = k_params
+        if len(this_dist) > 0:
+            distortions[irrep] = this_dist
+            directions_dict[irrep] = direct['Dir']
     return distortions, directions_dict
 
+@lru_cache(maxsize=None)
+def _frac_to_float(number):
+    """float of a (possibly fractional) number string from isotropy"""
+    return float(Fraction(number))
+
+# sympy expressions are immutable, so parsed direction components can be shared
+@lru_cache(maxsize=4096)
+def _parse_dir_expr(expr):
+    """sympy expression of a direction component string from isotropy"""
+    return parse_expr(expr, transformations=transformations)
+
+@lru_cache(maxsize=None)
+def _direction_function(direction):
+    """
+    free symbols of a direction (tuple of component strings) and a compiled
+    function giving the components from values of those symbols
+    """
+    syms = []
+    amp_sym = []
+    for el in direction:
+        el_sym = _parse_dir_expr(el)
+        amp_sym.append(el_sym)
+        for s in el_sym.free_symbols:
+            if s not in syms:
+                syms.append(s)
+    return syms, lambdify(syms, amp_sym, 'numpy')
+
+@lru_cache(maxsize=None)
+def _direction_linear_system(direction):
+    """
+    parsed components and free symbols of a direction (tuple of component strings),
+    and if the components are linear in the symbols with a unique solution
+    the float arrays (A, b) such that the components are A x - b, otherwise (None, None)
+    """
+    pos_d_syms = [_parse_dir_expr(pos_d) for pos_d in direction]
+    syms = list(set().union(*[pos_d_sym.free_symbols for pos_d_sym in pos_d_syms]))
+    if not syms:
+        return pos_d_syms, syms, None, None
+    try:
+        coeffs, consts = linear_eq_to_matrix(pos_d_syms, syms)
+        coeffs = np.array(coeffs.tolist(), dtype=float)
+        consts = np.array(consts.tolist(), dtype=float).ravel()
+    except (NonlinearError, TypeError):
+        return pos_d_syms, syms, None, None
+    if np.linalg.matrix_rank(coeffs) < len(syms):
+        return pos_d_syms, syms, None, None
+    return pos_d_syms, syms, coeffs, consts
+
+@lru_cache(maxsize=4096, typed=True)
+def _sympify_cached(value):
+    # typed, so 1 and 1.0 stay an Integer and a Float
+    return sympify(value)
+
+def _wyckoff_arrays(wyck):
+    """
+    points (n_sites, 3) and projected vectors (n_sites, n_proj_vecs, 3) of a
+    wyckoff from isotropy as float arrays, isotropy leaves out the outer list
+    when there is only one site or one projected vector per site
+    """
+    points = np.asarray(wyck["Point"], dtype=object)
+    points = np.array([_frac_to_float(i) for i in points.ravel()]).reshape(-1, 3)
+    projvecs = np.asarray(wyck["Projected Vectors"], dtype=object)
+    projvecs = np.array([_frac_to_float(i) for i in projvecs.ravel()]).reshape(len(points), -1, 3)
+    return points, projvecs
+
 def convert_distortions_basis(distortions, origin,
                               lat1, lat2):
+    to_lat2 = make_frac_converter(lat1, lat2)
+    origin = np.asarray(origin, dtype=float)
     irreps = {}
     for irrep, wycks in distortions.items():
         irreps[irrep] = []
         for wyck in wycks:
+            # all points, and all projected vectors, are converted at once
+            # Point is kept as an (n_sites, 3) array like Projected Vectors
+            pts, vcs = _wyckoff_arrays(wyck)
+            vcs_sc_basis = np.round(to_lat2(vcs), decimals=5)
             wyck_sc = {"Wyckoff": wyck["Wyckoff"],
-                       "Point": [],
-                       "Projected Vectors": []}
+                       "Point": np.round(to_lat2(pts + origin), decimals=5),
+                       "Projected Vectors": np.round(vcs_sc_basis / abs(vcs_sc_basis).max(), 5)}
             if 'k_params' in wyck.keys():
                 wyck_sc['k_params'] = wyck['k_params']
-    
-            # need to check if we have only one site
-            if type(wyck["Point"][0]) is not list:
-                wyck["Point"] = [wyck["Point"]]
-                wyck["Projected Vectors"] = [wyck["Projected Vectors"]]
-    
-            # also need to check if only 1 proj vector for each site (should we change last step?)
-            if type(wyck["Projected Vectors"][0][0]) is not list:
-                wyck["Projected Vectors"] = [[pv] for pv in wyck["Projected Vectors"]]
-    
-            for pt, vcs in zip(wyck["Point"], wyck["Projected Vectors"]):
-                pt = np.array([float(Fraction(i)) for i in pt]) + origin
-                wyck_sc["Point"].append(list(np.round_(frac_vec_convert(pt, lat1, lat2),
-                                                       decimals=5)))
-                this_sites_vcs = []
-                for vc in vcs:
-                    vc = np.array([float(Fraction(i)) for i in vc])
-                    vc_sc_basis = list(np.round_(frac_vec_convert(vc, lat1, lat2),
-                                                 decimals=5))
-                    this_sites_vcs.append(vc_sc_basis)
-                wyck_sc["Projected Vectors"].append(this_sites_vcs)
-            wyck_sc["Projected Vectors"] = np.round(wyck_sc["Projected Vectors"] / abs(np.array(wyck_sc["Projected Vectors"])).max(), 5)
             irreps[irrep].append(wyck_sc)
     return irreps
 
 
 # TODO: possibly clean this up now that we really only use this for one wyckoff at a time
-def get_distortion_dec_struct(wycks, struct_to_match, high_sym_wyckoff, struct_hs):
+def _wyckoff_species_map(high_sym_wyckoff, struct_hs):
+    """specie of the first site of each wyckoff position in struct_hs"""
+    wyck_to_specie = {}
+    for i, ss in enumerate(high_sym_wyckoff):
+        wyck_to_specie.setdefault(ss, struct_hs[i].specie)
+    return wyck_to_specie
+
+def get_distortion_dec_struct(wycks, struct_to_match, high_sym_wyckoff, struct_hs, wyck_to_specie=None):
+    if wyck_to_specie is None:
+        wyck_to_specie = _wyckoff_species_map(high_sym_wyckoff, struct_hs)
     coords = []
     species = []
     proj_vecs = []
@@ -240,21 +338,19 @@ def get_distortion_dec_struct(wycks, struct_to_match, high_sym_wyckoff, struct_h
             continue
         wycks_done.append(w)  # dirty maybe wrong fix
 
-        for i, ss in enumerate(high_sym_wyckoff):
-            if ss == w:
-                sp = struct_hs[i].specie
-                break
+        sp = wyck_to_specie[w]
         for coord, pv in zip(wyck["Point"], wyck["Projected Vectors"]):
             species.append(sp)
             coords.append(coord)
             proj_vecs.append(pv)
-    logger.debug("get_distortion_dec_struct:")
-    logger.debug("coords:\n{}".format(coords))
-    logger.debug("species:\n{}".format(species))
-    logger.debug("proj_vecs:\n{}".format(proj_vecs))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("get_distortion_dec_struct:")
+        logger.debug("coords:\n%s", coords)
+        logger.debug("species:\n%s", species)
+        logger.debug("proj_vecs:\n%s", proj_vecs)
     lat = struct_to_match.lattice
     dist_struct = Structure(lat, species, coords, site_properties={"projvecs": proj_vecs})
-    logger.debug("dist_struct:\n{}".format(dist_struct))
+    logger.debug("dist_struct:\n%s", dist_struct)
 
     # sm_dist = StructureMatcher(ltol = 0.02, primitive_cell=False, allow_subset=True)
     sm_dist = ModifiedSM_I(ltol = 0.02, primitive_cell=False, allow_subset=True)
@@ -265,24 +361,31 @@ def get_distortion_dec_struct(wycks, struct_to_match, high_sym_wyckoff, struct_h
         logger.warning("dist dec struct:\n{}".format(dist_struct))
         logger.warning("struct to match:\n{}".format(struct_to_match))
     logger.debug("matching dist def to struct")
-    dist_struct_matched = dist_struct * sc_d
-    dist_struct_matched.translate_sites(list(range(len(dist_struct_matched))), trans_d)
-    logger.debug(struct_to_match)
-    logger.debug(dist_struct)
-    logger.debug(sc_d)
-    logger.debug(trans_d)
-    logger.debug(mapping)
-    logger.debug(dist_struct_matched)
-    logger.debug("\n")
+    # sc_d is always the identity here (ModifiedSM_I only allows translations)
+    # so this is dist_struct with all sites translated by trans_d
+    dist_struct_matched = Structure(lat, dist_struct.species,
+                                    np.mod(dist_struct.frac_coords + trans_d, 1.),
+                                    site_properties={"projvecs": proj_vecs})
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(struct_to_match)
+        logger.debug(dist_struct)
+        logger.debug(sc_d)
+        logger.debug(trans_d)
+        logger.debug(mapping)
+        logger.debug(dist_struct_matched)
+        logger.debug("\n")
     return dist_struct_matched, mapping
 
-def get_projection_data(displacements, wycks, struct_hs_supercell, high_sym_wyckoff, struct_hs):
+def get_projection_data(displacements, wycks, struct_hs_supercell, high_sym_wyckoff, struct_hs, wyck_to_specie=None):
+    if wyck_to_specie is None:
+        wyck_to_specie = _wyckoff_species_map(high_sym_wyckoff, struct_hs)
+    # frac to cartesian for row vectors, as lattice.get_cartesian_coords
+    lat_matrix = struct_hs_supercell.lattice.matrix
     results_by_wyck = {}
     for n, wyck in enumerate(wycks):
         num_proj_vecs = len(wycks[0]["Projected Vectors"][0])
-        amplitudes = [0. for i in range(num_proj_vecs)]
-        amplitude_as_comps = [0. for i in range(num_proj_vecs)]
-        dist_struct_matched, mapping = get_distortion_dec_struct([wyck], struct_hs_supercell, high_sym_wyckoff, struct_hs)
+        dist_struct_matched, mapping = get_distortion_dec_struct([wyck], struct_hs_supercell, high_sym_wyckoff, struct_hs,
+                                                                 wyck_to_specie=wyck_to_specie)
         dist_defs = dist_struct_matched
         full_projvecs = []
         for i, j in enumerate(mapping):
@@ -292,27 +395,24 @@ def get_projection_data(displacements, wycks, struct_hs_supercell, high_sym_wyck
             else:
                 full_projvecs.append([[0., 0., 0.] for i in range(num_proj_vecs)])
         logger.debug(struct_hs_supercell.lattice)
-        for i in range(num_proj_vecs):
-            sum_cart_squares = 0.
-            for pv in full_projvecs:
-                pv_cart = struct_hs_supercell.lattice.get_cartesian_coords(pv[i])
-                sum_cart_squares += pv_cart.dot(pv_cart)
-            norm_factor = sum_cart_squares**(-1/2)
-            for disp, pv in zip(displacements, full_projvecs):
-                logger.debug(i)
-                logger.debug('frac dot prod{}'.format(np.dot(disp, pv[i])))
-                amplitudes[i] += np.dot(disp, pv[i])
-                disp_cart = struct_hs_supercell.lattice.get_cartesian_coords(disp)
-                pv_cart = struct_hs_supercell.lattice.get_cartesian_coords(pv[i])
-                logger.debug('norm factor: {}'.format(norm_factor))
-                logger.debug('cart dot prod: {}'.format(np.dot(norm_factor * disp_cart, pv_cart)))
-                logger.debug('disp_frac: {}'.format(disp))
-                logger.debug('disp_cart: {}'.format(disp_cart))
-                logger.debug('pv_frac: {}'.format(pv[i]))
-                logger.debug('pv_cart: {}\n\n'.format(pv_cart))
-                amplitude_as_comps[i] += np.dot(norm_factor * disp_cart, pv_cart)
-        logger.debug('amplitude_as_comps: {}\n'.format(amplitude_as_comps))
-        amplitude_as = np.sqrt(np.sum([am**2 for am in amplitude_as_comps]))
+        # projected vectors of every site (n_sites, num_proj_vecs, 3) and displacements (n_sites, 3)
+        # this wyckoff can have a different number of projected vectors than wycks[0],
+        # only the first num_proj_vecs of each site are used (zero padded if there are fewer)
+        pvs = np.zeros((len(full_projvecs), num_proj_vecs, 3))
+        for site_pvs, pv in zip(pvs, full_projvecs):
+            pv = np.asarray(pv, dtype=float).reshape(-1, 3)[:num_proj_vecs]
+            site_pvs[:len(pv)] = pv
+        pvs_cart = np.dot(pvs, lat_matrix)
+        # normalization uses every site, while amplitudes only use sites with a displacement
+        sum_cart_squares = np.einsum('spk,spk->p', pvs_cart, pvs_cart)
+        norm_factor = sum_cart_squares**(-1/2)
+        n_sites = min(len(displacements), len(pvs))
+        disps = np.asarray(displacements, dtype=float)[:n_sites]
+        disps_cart = np.dot(disps, lat_matrix)
+        amplitudes = list(np.einsum('sk,spk->p', disps, pvs[:n_sites]))
+        amplitude_as_comps = list(norm_factor * np.einsum('sk,spk->p', disps_cart, pvs_cart[:n_sites]))
+        logger.debug('amplitude_as_comps: %s\n', amplitude_as_comps)
+        amplitude_as = np.linalg.norm(amplitude_as_comps)
         amplitude_ap = amplitude_as * np.sqrt(struct_hs.lattice.volume / struct_hs_supercell.lattice.volume)
 
         results_by_wyck['{}{}'.format(wyck['Wyckoff'], n)] = {
@@ -323,8 +423,7 @@ def get_projection_data(displacements, wycks, struct_hs_supercell, high_sym_wyck
             'dist_defs': dist_defs,
             'full_projvecs': full_projvecs,
             'num_proj_vecs': num_proj_vecs,
-            'total_amplitude': np.sqrt(np.sum([a**2
-                                               for a in amplitudes]))}
+            'total_amplitude': np.linalg.norm(amplitudes)}
         if 'k_params' in wyck.keys():
             results_by_wyck['{}{}'.format(wyck['Wyckoff'], n)]['k_params'] = wyck['k_params']
     return results_by_wyck
@@ -362,15 +461,20 @@ def get_amps_direction(parent, irrep, irrep_amp, isos=None, k_params=None):
 
     for lbl, domains in irrep_domains.items():
         for domain in domains:
-            syms = set()
             ddir = domain['Dir']
-            eqn_set = []
-            for pos_d, pos_a in zip(ddir, irrep_amp):
-                pos_d_sym = parse_expr(pos_d, transformations=transformations)
-                pos_a_sym = sympify(pos_a)
-                syms.update(pos_d_sym.free_symbols)
-                eqn_set.append(pos_d_sym - pos_a_sym)
-            syms = list(syms)
+            n_comps = min(len(ddir), len(irrep_amp))
+            pos_d_syms, syms, coeffs, consts = _direction_linear_system(tuple(ddir[:n_comps]))
+            if coeffs is not None:
+                # linear with a unique solution, solve numerically
+                rhs = np.asarray(irrep_amp[:n_comps], dtype=float) + consts
+                soln = np.linalg.lstsq(coeffs, rhs, rcond=None)[0]
+                if np.abs(np.dot(coeffs, soln) - rhs).max() > 1.e-8:
+                    continue
+                var_vals = list(zip([str(s) for s in syms], soln.tolist()))
+                logger.debug(var_vals)
+                return lbl, ddir, var_vals
+            eqn_set = [pos_d_sym - _sympify_cached(pos_a)
+                       for pos_d_sym, pos_a in zip(pos_d_syms, irrep_amp)]
             soln = linsolve(eqn_set, syms)
             if soln == EmptySet:
                 continue
@@ -442,7 +546,8 @@ def get_mode_decomposition(struct_hs, struct_ls, nonzero_only=False, general_dir
 
     logger.info("Basis: \n{}".format(basis))
     logger.info("Origin: {}".format(origin))
-    logger.debug("Origin using: {}".format([str(Fraction(i).limit_denominator(10)) for i in origin]))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Origin using: %s", [str(Fraction(i).limit_denominator(10)) for i in origin])
 
     this_subgroup_distortions, directions_dict = get_all_distortions(sgn_hs, list(set(wyckoff_list)),
                                                                      directions, basis, origin)
@@ -455,12 +560,14 @@ def get_mode_decomposition(struct_hs, struct_ls, nonzero_only=False, general_dir
     irrep_dist_defs = {}
     irrep_amplitudes = {}
 
+    wyck_to_specie = _wyckoff_species_map(wyckoff_list, struct_hs)
     mode_decomposition_data = {}
     with iso.IsotropySession() as isos:
         for irrep, wycks in all_in_sc_basis.items():
-            logger.debug("GETTING PROJECTIONS FOR IRREP {}".format(irrep))
+            logger.debug("GETTING PROJECTIONS FOR IRREP %s", irrep)
             proj_data_by_wyck = get_projection_data(displacements, wycks,
-                                                    struct_hs_supercell, wyckoff_list, struct_hs)
+                                                    struct_hs_supercell, wyckoff_list, struct_hs,
+                                                    wyck_to_specie=wyck_to_specie)
             # TODO: clean this up, also don't find directions for irreps with amp==0
             # should move a lot of the direction stuff to its own function
             for wyck in proj_data_by_wyck.keys():
@@ -469,18 +576,10 @@ def get_mode_decomposition(struct_hs, struct_ls, nonzero_only=False, general_dir
                 if np.sum(np.abs(this_amp)) < amp_cut:
                     proj_data_by_wyck[wyck]['direction'] = ('zero', [0.,0.,0.])
                     continue
-                syms = []
-                amp_sym = []
-                for el in directions_dict[irrep]:
-                    el_sym = parse_expr(el, transformations=transformations)
-                    amp_sym.append(el_sym)
-                    for s in el_sym.free_symbols:
-                        if s not in syms:
-                            syms.append(s)
+                syms, amp_func = _direction_function(tuple(directions_dict[irrep]))
                 if len(syms) != len(this_amp):
                     logger.warning("WARNING: irrep {} wyck {} has different number of params then amp components".format(irrep, wyck))
-                sym_val_pairs = [(sym, val) for sym, val in zip(syms, this_amp)]
-                this_amp_conv = [round(float(el_sym.subs(sym_val_pairs)), 4) for el_sym in amp_sym]
+                this_amp_conv = [round(float(val), 4) for val in amp_func(*this_amp[:len(syms)])]
                 logger.info("{}  {}".format(irrep, wyck))
                 k_params = None
                 if 'k_params' in proj_data_by_wyck[wyck].keys():
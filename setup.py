@@ -1,6 +1,17 @@
 #!/usr/bin/env python
 import setuptools
 
+# the compiled table parser is optional, pysotropy.core falls back to pure python
+try:
+    from Cython.Build import cythonize
+    ext_modules = cythonize([setuptools.Extension("pysotropy._parser",
+                                                  ["pysotropy/_parser.pyx"])])
+    # don't fail the install if it can't be compiled (cythonize drops optional=True)
+    for ext in ext_modules:
+        ext.optional = True
+except ImportError:
+    ext_modules = []
+
 with open("README.org", "r") as fh:
     long_description = fh.read()
 
@@ -14,6 +25,7 @@ setuptools.setup(
     long_description_content_type="text/org",
     url="https://github.com/jrbp/pysotropy",
     packages=setuptools.find_packages(),
+    ext_modules=ext_modules,
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: GNU General Public License v3 or later (GPLv3+)",
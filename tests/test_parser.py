@@ -0,0 +1,100 @@
+"""
+check that the compiled parser (pysotropy/_parser.pyx) gives the same results
+as the pure python versions in pysotropy/core.py
+"""
+import importlib.util
+import sys
+import unittest
+
+import pysotropy.core
+
+try:
+    from pysotropy import _parser
+except ImportError:
+    _parser = None
+
+
+def _load_pure_core():
+    """load a copy of core that doesn't pick up the compiled parser"""
+    saved = sys.modules.get('pysotropy._parser')
+    sys.modules['pysotropy._parser'] = None  # makes core's import of it fail
+    try:
+        spec = importlib.util.spec_from_file_location('pysotropy._pure_core',
+                                                      pysotropy.core.__file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        if saved is None:
+            del sys.modules['pysotropy._parser']
+        else:
+            sys.modules['pysotropy._parser'] = saved
+    return module
+
+
+# tables as isotropy displays them
+TABLES = [
+    [],
+    ['Irrep (ML)',
+     'GM1+',
+     'GM2+'],
+    ['Irrep (ML)  k vector',
+     'GM1+        (0,0,0)',
+     'X5-         (0,1/2,0)',
+     'SM2         (a,a,0)'],
+    ['Irrep (ML)  Subgroup      Dir   Basis Vectors            Origin',
+     'GM4-        99 P4mm       P1    (1,0,0),(0,1,0),(0,0,1)  (0,0,0)',
+     'R4+         140 I4/mcm    P1    (1,1,0),(-1,1,0),(0,0,2) (0,0,0)',
+     '                          C1    (1,0,0),(0,1,0),(0,0,1)  (1/2,1/2,1/2)'],
+    ['Wyckoff Point    Projected Vectors',
+     'a       (0,0,0)  (1,0,0)',
+     '                 (0,1,0)',
+     '        (1/2,0,0) (-1,0,0)',
+     '                 (0,-1,0)',
+     'b       (x,y,z)  (1,0,0)'],
+    ['Elements                 Matrix',
+     'E 0,0,0                   1  0  0',
+     '                          0  1  0',
+     '                          0  0  1',
+     'C4z 0,0,0                 0 -1  0',
+     '                          1  0  0',
+     '                          0  0  1'],
+    ['Irrep (ML)  Dir      Domains  Coupled',
+     'GM4-        (a,0,0)  6        (a,0,0|b,0,0), (c)',
+     'R4+         (a,a,a)  8        ((a,b),(c,d))'],
+]
+
+
+@unittest.skipIf(_parser is None, "compiled parser isn't built")
+class TestCompiledParser(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.pure = _load_pure_core()
+
+    def parse(self, parser, lines):
+        indexes = parser.detect_column_indexes(lines)
+        split_by_ind = [parser.split_line_by_indexes(indexes, line) for line in lines]
+        return (indexes, split_by_ind,
+                [{key: parser.detect_data_form_and_convert(prop)
+                  for key, prop in result.items()}
+                 for result in parser.detect_multirows_and_split(split_by_ind)])
+
+    def test_pure_core_is_pure(self):
+        self.assertIsNot(self.pure.detect_column_indexes, _parser.detect_column_indexes)
+
+    def test_tables(self):
+        for lines in TABLES:
+            with self.subTest(lines=lines):
+                self.assertEqual(self.parse(_parser, lines), self.parse(self.pure, lines))
+
+    def test_props(self):
+        props = ['', '  ', 'P4mm', '1/2', '(0,0,0)', '(1,0,0),(0,1,0),(0,0,1)',
+                 '(a,0,0|b,0,0), (c)', '((a,b),(c,d))', '(a)(b)(c)', 'x, (y, z)',
+                 'a | (b|c) | d', '0 -1  0', ['(1,0,0)', '(0,1,0)']]
+        for prop in props:
+            with self.subTest(prop=prop):
+                self.assertEqual(_parser.detect_data_form_and_convert(prop),
+                                 self.pure.detect_data_form_and_convert(prop))
+
+
+if __name__ == '__main__':
+    unittest.main()